@@ -3,112 +3,468 @@ import time
 from datetime import datetime
 from tabulate import tabulate
 import atexit
+import functools
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# Connection and error messages go through this logger; set METRICS_LOG_LEVEL (default
+# WARNING) to DEBUG or INFO to see connection setup and per-metric messages
+logger = logging.getLogger(__name__)
+_log_level = os.environ.get('METRICS_LOG_LEVEL', 'WARNING')
+if isinstance(logging.getLevelName(_log_level.upper()), int):
+    logger.setLevel(_log_level.upper())
+else:
+    # A typo here shouldn't break every app importing the module
+    logger.setLevel(logging.WARNING)
+    logger.warning("Unknown METRICS_LOG_LEVEL %r, using WARNING", _log_level)
 
 # 🌐 Global connection variable, initially None
 con = None
 
-def get_connection():
-    """Gets the existing DuckDB connection or creates a new one."""
-    global con
-    if con is None:
-        try:
-            print("Attempting to connect to DuckDB...")
-            con = duckdb.connect(database='function_metrics.db', read_only=False)
-            print("DuckDB connection successful. Setting up database...")
-            # Ensure the table exists when the connection is first made
-            setup_database(con) 
-        except duckdb.IOException as e:
-            print(f"Failed to connect to DuckDB due to lock: {e}")
-            # In a multi-process scenario like Flask reloader, 
-            # returning None might be better than raising immediately.
-            # The calling function should handle the None case.
-            return None 
-        except Exception as e:
-            print(f"An unexpected error occurred connecting to DuckDB: {e}")
-            return None
+# Set METRICS_READ_ONLY=1 in processes that only call get_metrics: they never open the
+# file read-write and keep a read-only connection (`_con_ro`) instead. DuckDB only allows
+# that while no process holds the file read-write.
+READ_ONLY = os.environ.get('METRICS_READ_ONLY') == '1'
+_con_ro = None
+
+# Set METRICS_RELOADER=1 when the app runs under Werkzeug's (Flask's) reloader. Only the
+# child that serves requests (WERKZEUG_RUN_MAIN=true) then opens the database; the
+# file-watching parent leaves the lock alone. Werkzeug marks nothing in the parent, so
+# this can't be detected without the app saying so.
+RELOADER = os.environ.get('METRICS_RELOADER') == '1'
+
+# Cursors on `con` / `_con_ro` handed out by lease(), so callers don't serialize on one handle
+POOL_SIZE = 4
+_pool = None
+_ro_pool = None
+_connect_lock = threading.Lock()
+
+# Metrics are queued by log_metric and written in batches by a background thread
+FLUSH_ROWS = 1000  # flush once this many metrics are queued
+FLUSH_SECONDS = 0.5  # ...or once the oldest queued metric has waited this long
+_log_q = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_STOP = object()  # queued by close_connection to stop the writer
+
+# Where metrics are written: "duckdb" (the function_metrics table) or "jsonl"
+# (hourly metrics-YYYYMMDDHH.jsonl files that several processes can append to
+# without contending for the DuckDB file lock)
+METRICS_SINK = os.environ.get('METRICS_SINK', 'duckdb')
+JSONL_DIR = os.environ.get('METRICS_JSONL_DIR', '.')
+_JSONL_FIELDS = ('function_name', 'start_time', 'duration_ms', 'status', 'error')
+
+# Set METRICS_USE_SEQUENCE=0 to create the table without the sno sequence (no extra DDL)
+USE_SEQUENCE = os.environ.get('METRICS_USE_SEQUENCE', '1') != '0'
+_sno_has_default = True  # cleared by setup_database for tables without the sequence default
+_start_time_is_timestamp = True  # cleared by setup_database for tables storing formatted strings
+
+_HEADERS = ['S.No', 'Function', 'Start Time', 'Duration (ms)', 'Status', 'Error']
+# get_metrics renders a plain pipe table; set METRICS_GRID_TABLE=1 for tabulate's boxed grid
+GRID_TABLE = os.environ.get('METRICS_GRID_TABLE') == '1'
+# Dashboards poll faster than metrics arrive, so the rendered table is reused for this long
+METRICS_CACHE_SECONDS = 0.5
+# (_write_generation when queried, time.monotonic() when rendered, table); swapped as a whole
+_metrics_cache = (0, 0.0, None)
+_write_generation = 0  # bumped by every flush, so a table queried before one is never served after it
+
+# SQL used on every flush / view, built once at import time
+_INSERT_METRIC_SQL = """
+INSERT INTO function_metrics
+(function_name, start_time, duration_ms, status, error)
+VALUES (?, ?, ?, ?, ?)
+"""
+# Single-statement fallback for tables whose sno has no sequence default
+_INSERT_METRIC_MAX_SNO_SQL = """
+INSERT INTO function_metrics
+SELECT COALESCE(MAX(sno), 0) + 1, ?, ?, ?, ?, ?
+FROM function_metrics
+"""
+# No extra index needed: sno is the PRIMARY KEY, and since rows are appended in
+# increasing sno order DuckDB runs this as a Top-N that skips row groups by zone map
+_SELECT_RECENT_SQL = """
+SELECT
+    sno,
+    function_name,
+    start_time,
+    duration_ms,
+    status,
+    COALESCE(error, '-') as error
+FROM function_metrics
+ORDER BY sno DESC
+LIMIT 10
+"""
+_SELECT_RECENT_JSONL_SQL = """
+SELECT
+    row_number() OVER (ORDER BY start_time) as sno,
+    function_name,
+    strftime(start_time, '%B %d %H:%M:%S.%g') as start_time,
+    duration_ms,
+    status,
+    COALESCE(error, '-') as error
+FROM read_json(?, columns = {
+    function_name: 'VARCHAR',
+    start_time: 'TIMESTAMP',
+    duration_ms: 'INTEGER',
+    status: 'VARCHAR',
+    error: 'VARCHAR'
+})
+ORDER BY sno DESC
+LIMIT 10
+"""
+
+def get_connection(read_only=False):
+    """Gets the existing DuckDB connection or creates a new one.
+
+    Callers that only query pass read_only=True. With METRICS_READ_ONLY=1 they
+    get the read-only connection and writers get None; otherwise everyone
+    shares the read-write connection.
+    """
+    if con is not None:
+        return con
+    if READ_ONLY and (not read_only or _con_ro is not None):
+        return _con_ro if read_only else None
+    if _in_reloader_parent():
+        # Leave the file lock to the reloader's child, which serves the requests
+        return None
+    with _connect_lock:
+        if READ_ONLY:
+            if _con_ro is None:
+                _connect_read_only()
+            return _con_ro
+        if con is None:
+            _connect()
     return con
 
+def _in_reloader_parent():
+    """True in the file-watching parent process of Werkzeug's (Flask's) reloader."""
+    # The reloader starts its child with WERKZEUG_RUN_MAIN=true; the parent has no marker.
+    # WERKZEUG_SERVER_FD is no hint either: run_simple sets it with or without the reloader
+    return RELOADER and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+def _make_pool(root):
+    pool = queue.Queue(maxsize=POOL_SIZE)
+    for _ in range(POOL_SIZE):
+        pool.put(root.cursor())
+    return pool
+
+def _connect():
+    """Opens the read-write connection; call with _connect_lock held."""
+    global con, _pool
+    try:
+        logger.debug("Attempting to connect to DuckDB...")
+        root = duckdb.connect(database='function_metrics.db', read_only=False)
+        logger.debug("DuckDB connection successful. Setting up database...")
+        # Ensure the table exists when the connection is first made
+        setup_database(root) 
+        # Publish the pool before `con` so lease() never sees one without the other
+        _pool = _make_pool(root)
+        con = root
+    except duckdb.IOException as e:
+        logger.warning("Failed to connect to DuckDB due to lock: %s", e)
+        # In a multi-process scenario like Flask reloader, 
+        # returning None might be better than raising immediately.
+        # The calling function should handle the None case.
+    except Exception as e:
+        logger.error("An unexpected error occurred connecting to DuckDB: %s", e)
+
+def _connect_read_only():
+    """Opens the METRICS_READ_ONLY connection; call with _connect_lock held."""
+    global _con_ro, _ro_pool
+    root = _open_read_only()
+    if root is not None:
+        _ro_pool = _make_pool(root)
+        _con_ro = root
+
+def _open_read_only():
+    """Opens the file read-only, or returns None if DuckDB refuses."""
+    try:
+        logger.debug("Attempting to connect to DuckDB read-only...")
+        root = duckdb.connect(database='function_metrics.db', read_only=True)
+        logger.debug("DuckDB read-only connection successful.")
+        return root
+    except Exception as e:
+        logger.warning("Failed to connect to DuckDB read-only: %s", e)
+        return None
+
+@contextmanager
+def lease(read_only=False):
+    """Borrows a cursor from the pool, or yields None if there is no connection.
+
+    A reader in a writing process whose read-write open failed (e.g. another
+    process holds the file read-only) gets a read-only connection for this one
+    query. It is closed afterwards: while it is open DuckDB refuses to open the
+    same file read-write in this process, so keeping it would block every
+    later write.
+    """
+    conn = get_connection(read_only)
+    if conn is None:
+        fallback = None
+        if read_only and not READ_ONLY and not _in_reloader_parent():
+            fallback = _open_read_only()
+        try:
+            yield fallback
+        finally:
+            if fallback is not None:
+                fallback.close()
+        return
+    with _connect_lock:
+        # close_connection() may have run since get_connection() returned
+        pool = _pool if conn is con else _ro_pool if conn is _con_ro else None
+    cursor = pool.get() if pool is not None else None
+    if cursor is None:
+        if pool is not None:
+            pool.put(None)  # Pass the "closed" marker on to the next waiter
+        yield None
+        return
+    try:
+        yield cursor
+    finally:
+        with _connect_lock:
+            if pool is _pool or pool is _ro_pool:
+                pool.put(cursor)
+            else:
+                # The pool was closed while this cursor was leased out
+                cursor.close()
+
 def close_connection():
-    """Closes the DuckDB connection if it exists."""
-    global con
-    if con is not None:
+    """Writes any queued metrics, then closes the pooled cursors and the DuckDB connections."""
+    global con, _pool, _con_ro, _ro_pool
+    _stop_writer()
+    # Unpublish under the lock so lease() sees both the connection and its pool or neither
+    with _connect_lock:
+        root, pool, con, _pool = con, _pool, None, None
+        root_ro, pool_ro, _con_ro, _ro_pool = _con_ro, _ro_pool, None, None
+    if root is not None:
+        try:
+            logger.debug("Closing DuckDB connection...")
+            _close_pool(pool)
+            root.close()
+            logger.debug("DuckDB connection closed.")
+        except Exception as e:
+            logger.error("Error closing DuckDB connection: %s", e)
+    if root_ro is not None:
         try:
-            print("Closing DuckDB connection...")
-            con.close()
-            con = None
-            print("DuckDB connection closed.")
+            _close_pool(pool_ro)
+            root_ro.close()
         except Exception as e:
-            print(f"Error closing DuckDB connection: {e}")
+            logger.error("Error closing read-only DuckDB connection: %s", e)
+
+def _close_pool(pool):
+    """Closes the idle cursors; leased ones are closed by lease() when they come back."""
+    while not pool.empty():
+        pool.get_nowait().close()
+    # Wakes any lease() already waiting on this pool; it yields None
+    pool.put(None)
+
+def _after_fork():
+    """Drops the parent's writer thread, queue, locks and connections in a forked child."""
+    # The thread didn't survive the fork, the locks may have been held by parent
+    # threads, and the DuckDB handles belong to the parent; the child opens its own
+    global con, _pool, _con_ro, _ro_pool, _connect_lock, _log_q, _writer, _writer_lock
+    con, _pool, _con_ro, _ro_pool = None, None, None, None
+    _connect_lock = threading.Lock()
+    _log_q, _writer, _writer_lock = queue.Queue(), None, threading.Lock()
 
 # Register cleanup on program exit
 atexit.register(close_connection)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 def setup_database(db_conn):
     """Sets up the necessary table in the database."""
     if db_conn is None:
-        print("Cannot setup database, connection is None.")
+        logger.warning("Cannot setup database, connection is None.")
         return
+    global _sno_has_default, _start_time_is_timestamp
     try:
-        db_conn.execute("""
+        if USE_SEQUENCE:
+            _add_sno_default(db_conn)
+            db_conn.execute("CREATE SEQUENCE IF NOT EXISTS function_metrics_sno START 1")
+        sno_default = "DEFAULT nextval('function_metrics_sno')" if USE_SEQUENCE else ""
+        db_conn.execute(f"""
         CREATE TABLE IF NOT EXISTS function_metrics (
-            sno INTEGER PRIMARY KEY,  -- Auto-incrementing serial number
+            sno INTEGER PRIMARY KEY {sno_default},  -- Auto-incrementing serial number
             function_name VARCHAR,
-            start_time VARCHAR,  -- Store as formatted string
+            start_time TIMESTAMP,  -- Formatted for display by get_metrics
             duration_ms INTEGER,
             status VARCHAR,
             error VARCHAR
         );
         """)
-        print("✅ Metrics database table verified/created.")
+        columns = {name: (default, data_type) for name, default, data_type in db_conn.execute("""
+        SELECT column_name, column_default, data_type FROM duckdb_columns()
+        WHERE table_name = 'function_metrics'
+        """).fetchall()}
+        # Tables created with USE_SEQUENCE off have no default for sno;
+        # those get it from MAX(sno) inside the INSERT instead
+        _sno_has_default = columns['sno'][0] is not None
+        # Tables created by older versions keep start_time as a formatted VARCHAR
+        _start_time_is_timestamp = columns['start_time'][1] == 'TIMESTAMP'
+        logger.info("✅ Metrics database table verified/created.")
     except Exception as e:
-        print(f"Error setting up database table: {e}")
+        logger.error("Error setting up database table: %s", e)
         # Don't raise here, allow the app to potentially continue
 
-def format_timestamp(dt):
-    return dt.strftime('%B %d %H:%M:%S.%f')[:-3]  # Only keep 3 decimal places for milliseconds
+def _add_sno_default(db_conn):
+    """Moves a function_metrics table from older versions onto the sno sequence."""
+    sno_default = db_conn.execute("""
+    SELECT column_default FROM duckdb_columns()
+    WHERE table_name = 'function_metrics' AND column_name = 'sno'
+    """).fetchone()
+    if sno_default is None or sno_default[0] is not None:
+        return # No table yet, or it already has the default
+    # Older versions numbered rows with MAX(sno) + 1, so the sequence continues from there
+    next_sno = db_conn.execute("SELECT COALESCE(MAX(sno), 0) + 1 FROM function_metrics").fetchone()[0]
+    db_conn.execute(f"CREATE SEQUENCE IF NOT EXISTS function_metrics_sno START {int(next_sno)}")
+    db_conn.execute("ALTER TABLE function_metrics ALTER COLUMN sno SET DEFAULT nextval('function_metrics_sno')")
+    logger.info("Migrated function_metrics to the function_metrics_sno sequence (next sno %s).", next_sno)
 
+_MONTHS = ('', 'January', 'February', 'March', 'April', 'May', 'June', 'July',
+           'August', 'September', 'October', 'November', 'December')
 
-def log_metric(function_name, start_time, end_time, status, error=None):
-    conn = get_connection()
-    if conn is None:
-        print(f"Skipping metric log for {function_name}: No DB connection.")
-        return # Can't log if connection failed
+def format_timestamp(dt):
+    # Same output as dt.strftime('%B %d %H:%M:%S.%f')[:-3], without the strftime call
+    return f"{_MONTHS[dt.month]} {dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}.{dt.microsecond // 1000:03d}"
 
+
+def log_metric(function_name, start_time, duration_ms, status, error=None):
     try:
-        duration_ms = int((end_time - start_time).total_seconds() * 1000)
-        formatted_start = format_timestamp(start_time)
-        
-        # Get next serial number
-        next_sno_result = conn.execute("SELECT COALESCE(MAX(sno), 0) + 1 FROM function_metrics").fetchone()
-        if next_sno_result is None:
-             print(f"Could not determine next sno for function_metrics.")
-             return
-        next_sno = next_sno_result[0]
-
-        print(next_sno, function_name, formatted_start, duration_ms, status, error)
-        conn.execute("""
-        INSERT INTO function_metrics 
-        (sno, function_name, start_time, duration_ms, status, error)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """, (next_sno, function_name, formatted_start, duration_ms, status, error))
-    except duckdb.IOException as e:
-        print(f"Database locked, cannot log metric for {function_name}: {e}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s %s %s %s %s", function_name, format_timestamp(start_time), duration_ms, status, error)
+        _start_writer()
+        _log_q.put_nowait((function_name, start_time, duration_ms, status, error))
     except Exception as e:
-        print(f"Error logging metric for {function_name}: {e}")
+        logger.error("Error logging metric for %s: %s", function_name, e)
+
+def _start_writer():
+    """Starts the background writer thread if it isn't running yet."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_writer_loop, name="metrics-writer", daemon=True)
+                _writer.start()
+
+def _stop_writer():
+    """Asks the writer thread to flush what is queued and exit, then waits for it."""
+    global _writer
+    # Held until the writer has exited: a writer started meanwhile could take
+    # the _STOP meant for this one, which would then never stop
+    with _writer_lock:
+        if _writer is not None:
+            _log_q.put(_STOP)
+            _writer.join()
+            _writer = None
+
+def _writer_loop():
+    """Collects up to FLUSH_ROWS metrics or waits FLUSH_SECONDS, then flushes them."""
+    while True:
+        item = _log_q.get()
+        if item is _STOP:
+            return
+        batch = [item]
+        deadline = time.monotonic() + FLUSH_SECONDS
+        stopping = False
+        while len(batch) < FLUSH_ROWS:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = _log_q.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        try:
+            _flush(batch)
+        except Exception as e:
+            # Keep the writer alive; losing one batch beats losing all later ones
+            logger.error("Error flushing %s metrics: %s", len(batch), e)
+        if stopping:
+            return
+
+def _flush(batch):
+    """Writes a batch of metrics to the configured sink."""
+    global _write_generation
+    if METRICS_SINK == 'jsonl':
+        _write_jsonl(batch)
+    else:
+        _insert_batch(batch)
+    # The batch is visible now, so the next get_metrics has to query again
+    _write_generation += 1
+
+def _insert_batch(batch):
+    """Inserts a batch of metrics into the function_metrics table."""
+    with lease() as conn:
+        if conn is None:
+            logger.warning("Dropping %s queued metrics: No DB connection.", len(batch))
+            return # Can't log if connection failed
+
+        try:
+            # sno comes from the function_metrics_sno sequence, or MAX(sno) on older tables
+            insert_sql = _INSERT_METRIC_SQL if _sno_has_default else _INSERT_METRIC_MAX_SNO_SQL
+            if not _start_time_is_timestamp:
+                batch = [(function_name, format_timestamp(start_time), duration_ms, status, error)
+                         for function_name, start_time, duration_ms, status, error in batch]
+            # One transaction per batch, so the WAL is synced once rather than per row.
+            # The Python client has no Appender; executemany prepares the INSERT once
+            # and binds each row in C instead of a Python-level execute per row
+            conn.execute("BEGIN TRANSACTION")
+            try:
+                conn.executemany(insert_sql, batch)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except duckdb.IOException as e:
+            logger.warning("Database locked, cannot flush %s metrics: %s", len(batch), e)
+        except Exception as e:
+            logger.error("Error flushing %s metrics: %s", len(batch), e)
+
+def _write_jsonl(batch):
+    """Appends a batch of metrics to the current hour's JSONL file."""
+    path = os.path.join(JSONL_DIR, datetime.now().strftime('metrics-%Y%m%d%H.jsonl'))
+    lines = []
+    for function_name, start_time, duration_ms, status, error in batch:
+        row = (function_name, start_time.isoformat(), duration_ms, status, error)
+        lines.append(json.dumps(dict(zip(_JSONL_FIELDS, row))) + "\n")
+    try:
+        # One write per batch keeps appends from different processes whole
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+    except OSError as e:
+        logger.error("Error writing %s metrics to %s: %s", len(batch), path, e)
+
+# Longest error message stored per metric; longer ones are cut off
+MAX_ERROR_LENGTH = 512
 
 # to execute the function with metrics
 # this is the decorator use it like this: @execute_with_metrics
 def execute_with_metrics(func):
+    name = func.__name__  # looked up once here rather than on every call
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        # Wall clock only stamps the start; the duration comes from the monotonic counter
         start_time = datetime.now()
+        t0 = time.perf_counter_ns()
         try:
             result = func(*args, **kwargs)
-            end_time = datetime.now()
-            log_metric(func.__name__, start_time, end_time, "success")
+            duration_ms = (time.perf_counter_ns() - t0) // 1_000_000
+            log_metric(name, start_time, duration_ms, "success")
             return result
         except Exception as e:
-            end_time = datetime.now()
-            log_metric(func.__name__, start_time, end_time, "error", str(e))
+            duration_ms = (time.perf_counter_ns() - t0) // 1_000_000
+            error = f"{type(e).__name__}: {e}"[:MAX_ERROR_LENGTH]
+            log_metric(name, start_time, duration_ms, "error", error)
             raise
 
     return wrapper
@@ -119,31 +475,72 @@ def execute_with_metrics(func):
 
 # to view the metrics
 def get_metrics():
-    conn = get_connection()
-    if conn is None:
-        return "Unable to fetch metrics - database connection failed."
+    generation, cached_at, table = _metrics_cache
+    if (table is not None and generation == _write_generation
+            and time.monotonic() - cached_at < METRICS_CACHE_SECONDS):
+        return table
+
+    # Read before querying: a flush committing mid-query makes this table stale
+    generation = _write_generation
+    if METRICS_SINK == 'jsonl':
+        return _get_jsonl_metrics(generation)
+
+    with lease(read_only=True) as conn:
+        if conn is None:
+            return "Unable to fetch metrics - database connection failed."
+
+        try:
+            # Plain fetchall: .arrow() + to_pylist() boxes every cell as well, measured
+            # slower at 10 to 100k rows, and would add a pyarrow dependency
+            results = [
+                (sno, function_name, format_timestamp(start_time) if isinstance(start_time, datetime) else start_time, *rest)
+                for sno, function_name, start_time, *rest in conn.execute(_SELECT_RECENT_SQL).fetchall()
+            ]
+            return _cache_table(results, generation)
+        except duckdb.IOException as e:
+            logger.warning("Database locked, cannot fetch metrics: %s", e)
+            return "Unable to fetch metrics - database is locked."
+        except Exception as e:
+            logger.error("Error getting metrics: %s", e)
+            # Return error string instead of raising, maybe more resilient for display
+            return f"Error fetching metrics: {e}"
+
+def _cache_table(rows, generation):
+    """Renders rows with _format_table and keeps the result for METRICS_CACHE_SECONDS.
+
+    generation is _write_generation from before the rows were queried; the table
+    is only served while no flush has happened since.
+    """
+    global _metrics_cache
+    table = _format_table(rows)
+    _metrics_cache = (generation, time.monotonic(), table)
+    return table
+
+def _format_table(rows):
+    """Renders metric rows under _HEADERS as a pipe-separated table."""
+    if GRID_TABLE:
+        return tabulate(rows, headers=_HEADERS, tablefmt='grid')
+    # Fixed six columns and at most 10 rows, so skip tabulate's generic type inference
+    cells = [_HEADERS] + [[str(c) for c in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(_HEADERS))]
+    lines = [" | ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip() for row in cells]
+    lines.insert(1, "-+-".join("-" * w for w in widths))
+    return "\n".join(lines)
+
+def _get_jsonl_metrics(generation):
+    """Reads the last 10 metrics back from the JSONL files."""
+    pattern = os.path.join(JSONL_DIR, 'metrics-*.jsonl')
+    if not glob.glob(pattern):
+        return _cache_table([], generation)
 
     try:
-        results = conn.execute("""
-        SELECT 
-            sno,
-            function_name,
-            start_time,
-            duration_ms,
-            status,
-            COALESCE(error, '-') as error
-        FROM function_metrics
-        ORDER BY sno DESC
-        LIMIT 10
-        """).fetchall()
-        headers = ['S.No', 'Function', 'Start Time', 'Duration (ms)', 'Status', 'Error']
-        return tabulate(results, headers=headers, tablefmt='grid')
-    except duckdb.IOException as e:
-        print(f"Database locked, cannot fetch metrics: {e}")
-        return "Unable to fetch metrics - database is locked."
+        # No file lock needed, so an in-memory DuckDB does the reading; one per
+        # call, as threads sharing duckdb's default connection overwrite each other's results
+        with duckdb.connect() as reader:
+            results = reader.execute(_SELECT_RECENT_JSONL_SQL, [pattern]).fetchall()
+        return _cache_table(results, generation)
     except Exception as e:
-        print(f"Error getting metrics: {e}")
-        # Return error string instead of raising, maybe more resilient for display
+        logger.error("Error getting metrics: %s", e)
         return f"Error fetching metrics: {e}"
 
 # ------------------------------------sample usage from here-----------------------------------------
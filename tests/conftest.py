@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import duckbd_driver
+
+
+@pytest.fixture
+def driver(tmp_path, monkeypatch):
+    """The driver module, working in a fresh directory and shut down after the test."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(duckbd_driver, 'JSONL_DIR', str(tmp_path))
+    duckbd_driver._metrics_cache = (0, 0.0, None)
+    yield duckbd_driver
+    duckbd_driver.close_connection()
+    duckbd_driver._metrics_cache = (0, 0.0, None)
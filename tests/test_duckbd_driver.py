@@ -0,0 +1,384 @@
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+import duckdb
+import pytest
+
+
+def create_old_table():
+    """Creates function_metrics the way versions before the sno sequence did."""
+    with duckdb.connect('function_metrics.db') as conn:
+        conn.execute("""
+        CREATE TABLE function_metrics (
+            sno INTEGER PRIMARY KEY,
+            function_name VARCHAR,
+            start_time VARCHAR,
+            duration_ms INTEGER,
+            status VARCHAR,
+            error VARCHAR
+        )
+        """)
+        conn.execute("INSERT INTO function_metrics VALUES (1, 'old', 'April 24 21:14:25.722', 1005, 'success', NULL)")
+
+
+def stored_rows():
+    with duckdb.connect('function_metrics.db') as conn:
+        return conn.execute("SELECT sno, function_name, start_time FROM function_metrics ORDER BY sno").fetchall()
+
+
+def sno_default():
+    with duckdb.connect('function_metrics.db') as conn:
+        return conn.execute("""
+        SELECT column_default FROM duckdb_columns()
+        WHERE table_name = 'function_metrics' AND column_name = 'sno'
+        """).fetchone()[0]
+
+
+def test_old_table_is_moved_onto_sequence(driver):
+    create_old_table()
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    sample_function()
+    driver.close_connection()
+
+    rows = stored_rows()
+    assert [sno for sno, _, _ in rows] == [1, 2, 3]
+    assert sno_default() is not None
+    # The old VARCHAR start_time column keeps getting formatted strings
+    assert all(isinstance(start_time, str) for _, _, start_time in rows)
+    assert 'sample_function' in driver.get_metrics()
+
+
+def test_table_without_sequence_numbers_rows_from_max(driver, monkeypatch):
+    monkeypatch.setattr(driver, 'USE_SEQUENCE', False)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    for _ in range(3):
+        sample_function()
+    driver.close_connection()
+
+    assert [sno for sno, _, _ in stored_rows()] == [1, 2, 3]
+    assert sno_default() is None
+
+
+def test_jsonl_sink_round_trip(driver, monkeypatch, tmp_path):
+    monkeypatch.setattr(driver, 'METRICS_SINK', 'jsonl')
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    @driver.execute_with_metrics
+    def failing_function():
+        raise Exception("Sample error")
+
+    sample_function()
+    try:
+        failing_function()
+    except Exception:
+        pass
+    driver.close_connection()
+
+    assert len(list(tmp_path.glob('metrics-*.jsonl'))) == 1
+    assert not (tmp_path / 'function_metrics.db').exists()
+    table = driver.get_metrics()
+    assert 'sample_function' in table
+    assert 'Exception: Sample error' in table
+
+
+def test_jsonl_concurrent_readers(driver, monkeypatch):
+    monkeypatch.setattr(driver, 'METRICS_SINK', 'jsonl')
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    driver.close_connection()
+
+    tables = []
+
+    def read():
+        # Past the cache, so every call runs the query
+        for _ in range(30):
+            tables.append(driver._get_jsonl_metrics(driver._write_generation))
+
+    readers = [threading.Thread(target=read) for _ in range(8)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    assert len(tables) == 240
+    assert all('sample_function' in table for table in tables)
+
+
+def test_close_connection_flushes_queued_metrics(driver, monkeypatch):
+    # Long enough that nothing is written unless close_connection drains the queue
+    monkeypatch.setattr(driver, 'FLUSH_SECONDS', 60)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    for _ in range(5):
+        sample_function()
+    driver.close_connection()
+
+    assert [sno for sno, _, _ in stored_rows()] == [1, 2, 3, 4, 5]
+    assert driver._writer is None
+
+
+def test_metric_logged_while_stopping_does_not_steal_the_stop(driver, monkeypatch):
+    monkeypatch.setattr(driver, 'FLUSH_SECONDS', 0.01)
+    flushing, release = threading.Event(), threading.Event()
+    flush = driver._flush
+
+    def slow_flush(batch):
+        if not flushing.is_set():
+            flushing.set()
+            release.wait()
+        flush(batch)
+
+    monkeypatch.setattr(driver, '_flush', slow_flush)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    assert flushing.wait(timeout=5)
+    stopper = threading.Thread(target=driver._stop_writer)
+    stopper.start()
+    time.sleep(0.1)  # Let it queue its _STOP
+    sample_function()
+    release.set()
+    stopper.join(timeout=5)
+    assert not stopper.is_alive()
+
+    # The second metric waits for the next writer rather than being lost
+    driver._start_writer()
+    driver.close_connection()
+    assert [sno for sno, _, _ in stored_rows()] == [1, 2]
+
+
+def test_metrics_cache_is_reused_until_a_flush(driver):
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    driver.close_connection()
+    table = driver.get_metrics()
+    assert driver.get_metrics() is table
+
+    sample_function()
+    driver.close_connection()
+    assert driver.get_metrics().count('sample_function') == 2
+
+
+def test_metrics_cache_skips_tables_queried_before_a_flush(driver, monkeypatch):
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    driver.close_connection()
+    format_table = driver._format_table
+
+    def flush_meanwhile(rows):
+        # A flush that commits after the query but before the table is cached
+        monkeypatch.setattr(driver, '_format_table', format_table)
+        driver._flush([('late_function', datetime.now(), 1, 'success', None)])
+        return format_table(rows)
+
+    monkeypatch.setattr(driver, '_format_table', flush_meanwhile)
+    assert 'late_function' not in driver.get_metrics()
+    assert 'late_function' in driver.get_metrics()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs os.fork")
+def test_forked_child_writes_its_own_metrics(driver, monkeypatch, tmp_path):
+    monkeypatch.setattr(driver, 'METRICS_SINK', 'jsonl')
+    monkeypatch.setattr(driver, 'FLUSH_SECONDS', 60)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()  # The parent's writer is running (and its metric queued) when we fork
+    pid = os.fork()
+    if pid == 0:
+        sample_function()
+        driver.close_connection()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    driver.close_connection()
+
+    lines = [line for path in tmp_path.glob('metrics-*.jsonl') for line in path.open()]
+    # One from each process: the child neither loses its own metric nor repeats the parent's
+    assert len(lines) == 2
+
+
+def test_close_connection_while_cursors_are_leased(driver):
+    with contextlib.ExitStack() as stack:
+        leased = [stack.enter_context(driver.lease()) for _ in range(driver.POOL_SIZE)]
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(driver.lease().__enter__()))
+        waiter.start()
+        time.sleep(0.1)  # Let it block on the empty pool
+        driver.close_connection()
+        waiter.join(timeout=5)
+        assert waited == [None]
+    # Handed back after the close, so closed instead of pooled
+    for cursor in leased:
+        with pytest.raises(duckdb.ConnectionException):
+            cursor.execute("SELECT 1")
+
+
+def hold_read_only():
+    """Starts another process that keeps function_metrics.db open read-only until closed."""
+    holder = subprocess.Popen(
+        [sys.executable, '-c',
+         "import duckdb, sys; c = duckdb.connect('function_metrics.db', read_only=True); "
+         "print('ready', flush=True); sys.stdin.read()"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == 'ready'
+    return holder
+
+
+def release(holder):
+    holder.stdin.close()
+    holder.wait(timeout=30)
+
+
+def test_read_only_fallback_does_not_block_later_writes(driver):
+    driver.get_connection()
+    driver.close_connection()
+    holder = hold_read_only()
+    try:
+        # The read-write open fails on the other process's lock; the query falls
+        # back to a read-only connection that is closed right after
+        assert driver.get_metrics().startswith('S.No')
+        assert driver.con is None and driver._con_ro is None
+    finally:
+        release(holder)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    driver.close_connection()
+    assert [name for _, name, _ in stored_rows()] == ['sample_function']
+
+
+def test_read_only_process_reads_and_drops_writes(driver, monkeypatch):
+    driver.get_connection()
+    driver.close_connection()
+    monkeypatch.setattr(driver, 'READ_ONLY', True)
+
+    @driver.execute_with_metrics
+    def sample_function():
+        return "Success"
+
+    sample_function()
+    assert driver.get_metrics().startswith('S.No')
+    assert driver._con_ro is not None and driver.con is None
+    driver.close_connection()
+    assert stored_rows() == []
+
+
+SERVER = """
+import sys
+from werkzeug.serving import run_simple
+import duckbd_driver
+
+@duckbd_driver.execute_with_metrics
+def handle_request():
+    return b"ok"
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    if environ["PATH_INFO"] == "/metrics":
+        return [duckbd_driver.get_metrics().encode()]
+    return [handle_request()]
+
+run_simple("127.0.0.1", int(sys.argv[1]), app, use_reloader=False)
+"""
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read().decode()
+
+
+def test_server_without_reloader_writes_metrics(tmp_path):
+    pytest.importorskip('werkzeug')
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env.pop('METRICS_RELOADER', None)
+    server = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=tmp_path, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                assert fetch(base + '/') == 'ok'
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        # The writer flushes within FLUSH_SECONDS; the view is cached for a moment too
+        while 'handle_request' not in fetch(base + '/metrics'):
+            assert time.monotonic() < deadline, 'metric was never written'
+            time.sleep(0.2)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_reloader_parent_detection(driver, monkeypatch):
+    # run_simple sets WERKZEUG_SERVER_FD even without the reloader, so it must not matter
+    monkeypatch.setenv('WERKZEUG_SERVER_FD', '3')
+    monkeypatch.delenv('WERKZEUG_RUN_MAIN', raising=False)
+    assert not driver._in_reloader_parent()
+    assert driver.get_connection() is not None
+    driver.close_connection()
+
+    monkeypatch.setattr(driver, 'RELOADER', True)
+    assert driver._in_reloader_parent()
+    assert driver.get_connection() is None
+    assert driver.get_connection(read_only=True) is None
+
+    monkeypatch.setenv('WERKZEUG_RUN_MAIN', 'true')
+    assert not driver._in_reloader_parent()
+    assert driver.get_connection() is not None
+
+
+@pytest.mark.parametrize('value, expected', [('debug', 'DEBUG'), ('VERBOSE', 'WARNING')])
+def test_log_level_from_environment(value, expected):
+    env = dict(os.environ, METRICS_LOG_LEVEL=value,
+               PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run(
+        [sys.executable, '-c',
+         "import logging, duckbd_driver; print(logging.getLevelName(duckbd_driver.logger.level))"],
+        env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == expected